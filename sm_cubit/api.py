@@ -152,6 +152,18 @@ class API:
         for _ in range(iterations):
             self.__pixel_grid__ = improver.pad_edges(self.__pixel_grid__)
 
+    def improve_pixels(self, clean:bool=True, smoothen:bool=True, pad:bool=True) -> None:
+        """
+        Cleans, smoothens, and pads the pixels in a single pass over the grid
+
+        Parameters:
+        * `clean`:    Whether to clean up the pixels
+        * `smoothen`: Whether to smoothen the grain edges
+        * `pad`:      Whether to pad the grain edges
+        """
+        self.__print__("Improving the pixels in a single pass")
+        self.__pixel_grid__ = improver.improve_grid(self.__pixel_grid__, clean, smoothen, pad)
+
     def assimilate(self, threshold:int=5) -> None:
         """
         Forces the small grains to merge with neighbouring, bigger grains
@@ -12,6 +12,7 @@ import numpy as np
 VOID_PIXEL_ID       = 100000 # large number
 UNORIENTED_PIXEL_ID = 100001 # large number + 1
 NO_ORIENTATION      = [0, 0, 0] # for both void and unoriented
+NEIGHBOUR_OFFSETS   = np.array([(-1, 0), (1, 0), (0, -1), (0, 1)], dtype=np.int32) # (dx, dy)
 
 def get_void_pixel_grid(x_cells:list, y_cells:list) -> list:
     """
@@ -24,13 +25,7 @@ def get_void_pixel_grid(x_cells:list, y_cells:list) -> list:
     
     Returns a grid of void pixels
     """
-    pixel_grid = []
-    for _ in range(y_cells):
-        pixel_list = []
-        for _ in range(x_cells):
-            pixel_list.append(VOID_PIXEL_ID)
-        pixel_grid.append(pixel_list)
-    return pixel_grid
+    return np.full((y_cells, x_cells), VOID_PIXEL_ID, dtype=np.int32)
 
 def replace_pixels(pixel_grid:list, coordinates_list:list, replacement:str="void") -> list:
     """
@@ -200,13 +195,12 @@ def get_neighbours(x:float, y:float, x_size:int, y_size:int) -> list:
     * `x_size`: The maximum x value 
     * `y_size`: The maximum y value
     
-    Returns a list of the neighbouring coordinates 
+    Returns a list of the neighbouring coordinates
     """
-    neighbours = [(x-1, y), (x+1, y), (x, y-1), (x, y+1)]
     neighbours = [
-        neighbour for neighbour in neighbours
-        if neighbour[0] >= 0 and neighbour[0] < x_size
-        and neighbour[1] >= 0 and neighbour[1] < y_size
+        (x+dx, y+dy) for dx, dy in NEIGHBOUR_OFFSETS
+        if x+dx >= 0 and x+dx < x_size
+        and y+dy >= 0 and y+dy < y_size
     ]
     return neighbours
 
@@ -220,19 +214,19 @@ def get_all_neighbours(x_list:list, y_list:list, x_size:int, y_size:int):
     * `x_size`: The maximum x value 
     * `y_size`: The maximum y value
     
-    Returns a list of all the neighbouring coordinates 
+    Returns a list of all the neighbouring coordinates
     """
-    
-    # Gets all the neighbours
-    all_neighbours = []
-    for i in range(len(x_list)):
-        neighbours = get_neighbours(x_list[i], y_list[i], x_size, y_size)
-        all_neighbours += neighbours
-    
-    # Remove duplicates and neighbours in the group
-    all_neighbours = list(set(all_neighbours))
-    group = [(x_list[i],y_list[i]) for i in range(len(x_list))]
-    all_neighbours = [neighbour for neighbour in all_neighbours if not neighbour in group]
 
-    # Return
+    # Gets all the neighbours by offsetting the group in each direction
+    coordinates = np.column_stack((x_list, y_list)).astype(np.int32)
+    all_neighbours = (coordinates[:,None,:] + NEIGHBOUR_OFFSETS[None,:,:]).reshape(-1, 2)
+
+    # Remove out-of-bounds coordinates and duplicates
+    in_bounds = ((all_neighbours[:,0] >= 0) & (all_neighbours[:,0] < x_size) &
+                 (all_neighbours[:,1] >= 0) & (all_neighbours[:,1] < y_size))
+    all_neighbours = np.unique(all_neighbours[in_bounds], axis=0)
+
+    # Remove neighbours in the group and return
+    group = set(zip(x_list, y_list))
+    all_neighbours = [tuple(neighbour) for neighbour in all_neighbours.tolist() if not tuple(neighbour) in group]
     return all_neighbours
@@ -0,0 +1,166 @@
+"""
+ Title:         Improver Numba Kernels
+ Description:   JIT-compiled inner loops for improving the quality of the grid
+ Author:        Janzen Choi
+
+"""
+
+# Libraries
+import numpy as np
+from numba import njit, prange
+
+@njit(cache=True, parallel=True)
+def _clean(grid:np.ndarray, void_id:int, unoriented_id:int) -> np.ndarray:
+    """
+    Cleans the pixel grid by replacing stray void / live pixels;
+    decisions are made from the unmodified input grid so that the
+    rows can be processed in parallel
+
+    Parameters:
+    * `grid`:          The 2D array of pixel IDs
+    * `void_id`:       The ID of the void pixels
+    * `unoriented_id`: The ID of the unoriented pixels
+
+    Returns the cleaned 2D array of pixel IDs
+    """
+
+    # Dimensions of the pixel grid and output buffer
+    y_size, x_size = grid.shape
+    cleaned = grid.copy()
+
+    # Iterate through each row in parallel
+    for row in prange(y_size):
+        for col in range(x_size):
+
+            # Ignore if it's added material
+            pixel = grid[row, col]
+            if pixel == unoriented_id:
+                continue
+
+            # Count the void neighbours and reservoir-sample a random neighbour
+            num_void = 0
+            num_neighbours = 0
+            pick_row, pick_col = -1, -1
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    if abs(dy) + abs(dx) != 1:
+                        continue
+                    n_row, n_col = row + dy, col + dx
+                    if n_row < 0 or n_row >= y_size or n_col < 0 or n_col >= x_size:
+                        continue
+                    num_neighbours += 1
+                    num_void += grid[n_row, n_col] == void_id
+                    if np.random.randint(0, num_neighbours) == 0:
+                        pick_row, pick_col = n_row, n_col
+
+            # If half (or less) of the neighbours are void, then fill a void pixel
+            if pixel == void_id and 2 * num_void <= num_neighbours and num_neighbours > 0:
+                value = grid[pick_row, pick_col]
+                if value != unoriented_id:
+                    cleaned[row, col] = value
+
+            # If more than half of the neighbours are void, then remove a live pixel
+            elif pixel != void_id and 2 * num_void > num_neighbours:
+                cleaned[row, col] = void_id
+
+    # Return cleaned grid
+    return cleaned
+
+@njit(cache=True, parallel=True)
+def _smoothen(grid:np.ndarray, unoriented_id:int) -> np.ndarray:
+    """
+    Smoothens the edges of grains by merging pixels; decisions are made
+    from the unmodified input grid so that the rows can be processed in
+    parallel
+
+    Parameters:
+    * `grid`:          The 2D array of pixel IDs
+    * `unoriented_id`: The ID of the unoriented pixels
+
+    Returns the smoothed 2D array of pixel IDs
+    """
+
+    # Dimensions of the pixel grid and output buffer
+    y_size, x_size = grid.shape
+    smoothed = grid.copy()
+
+    # Iterate through each row in parallel
+    for row in prange(y_size):
+        for col in range(x_size):
+
+            # Ignore if it's added material
+            pixel = grid[row, col]
+            if pixel == unoriented_id:
+                continue
+
+            # Count the foreign neighbours and reservoir-sample one of them
+            num_foreign = 0
+            pick_row, pick_col = -1, -1
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    if abs(dy) + abs(dx) != 1:
+                        continue
+                    n_row, n_col = row + dy, col + dx
+                    if n_row < 0 or n_row >= y_size or n_col < 0 or n_col >= x_size:
+                        continue
+                    if grid[n_row, n_col] != pixel:
+                        num_foreign += 1
+                        if np.random.randint(0, num_foreign) == 0:
+                            pick_row, pick_col = n_row, n_col
+
+            # If there are more than 2 foreign neighbours, get absorbed
+            if num_foreign > 2:
+                value = grid[pick_row, pick_col]
+                if value != unoriented_id:
+                    smoothed[row, col] = value
+
+    # Return smoothed grid
+    return smoothed
+
+@njit(cache=True, parallel=True)
+def _pad(grid:np.ndarray, void_id:int) -> np.ndarray:
+    """
+    Pads the pixel grid by replicating unvoided pixels; the output is a
+    separate buffer so the rows can be processed in parallel
+
+    Parameters:
+    * `grid`:    The 2D array of pixel IDs
+    * `void_id`: The ID of the void pixels
+
+    Returns the padded 2D array of pixel IDs
+    """
+
+    # Dimensions of the pixel grid and output buffer
+    y_size, x_size = grid.shape
+    padded = np.full_like(grid, void_id)
+
+    # Iterate through each row in parallel
+    for row in prange(y_size):
+        for col in range(x_size):
+
+            # If live, copy and skip
+            if grid[row, col] != void_id:
+                padded[row, col] = grid[row, col]
+                continue
+
+            # Count the live neighbours and reservoir-sample one of them
+            num_live = 0
+            pick_row, pick_col = -1, -1
+            for dy in range(-1, 2):
+                for dx in range(-1, 2):
+                    if abs(dy) + abs(dx) != 1:
+                        continue
+                    n_row, n_col = row + dy, col + dx
+                    if n_row < 0 or n_row >= y_size or n_col < 0 or n_col >= x_size:
+                        continue
+                    if grid[n_row, n_col] != void_id:
+                        num_live += 1
+                        if np.random.randint(0, num_live) == 0:
+                            pick_row, pick_col = n_row, n_col
+
+            # If there is a live neighbour, then fill this void pixel
+            if num_live > 0:
+                padded[row, col] = grid[pick_row, pick_col]
+
+    # Return padded grid
+    return padded
@@ -1,229 +1,328 @@
-"""
- Title:         Improver
- Description:   Improves the quality of the grid
- Author:        Janzen Choi
-
-"""
-
-# Libraries
-import sm_cubit.maths.pixel_maths as pixel_maths
-from random import randint
-from copy import deepcopy
-
-def clean_pixel_grid(pixel_grid:list) -> list:
-    """
-    Cleans the pixel grid by replacing stray void / live pixels
-    
-    Parameters:
-    * `pixel_grid`: The uncleaned grid of pixels
-    
-    Returns the cleaned pixel grid
-    """
-
-    # Dimensions of the pixel grid
-    x_size = len(pixel_grid[0])
-    y_size = len(pixel_grid)
-    
-    # Iterate through each pixel
-    for row in range(y_size):
-        for col in range(x_size):
-
-            # Ignore if it's added material
-            if pixel_grid[row][col] == pixel_maths.UNORIENTED_PIXEL_ID:
-                continue
-
-            # Evaluate neighbouring pixels
-            neighbours = pixel_maths.get_neighbours(col, row, x_size, y_size)
-            void_neighbours = [n for n in neighbours if pixel_grid[n[1]][n[0]] == pixel_maths.VOID_PIXEL_ID]
-            num_void = len(void_neighbours)
-            
-            # If half (or less) of the neighbours are void, then fill a void pixel
-            if pixel_grid[row][col] == pixel_maths.VOID_PIXEL_ID and num_void <= len(neighbours) / 2:
-                copy = neighbours[randint(0, len(neighbours) - 1)]
-                if pixel_grid[copy[1]][copy[0]] == pixel_maths.UNORIENTED_PIXEL_ID:
-                    continue
-                pixel_grid[row][col] = pixel_grid[copy[1]][copy[0]]
-
-            # If more than half of the neighbours are void, then remove a live pixel
-            if pixel_grid[row][col] != pixel_maths.VOID_PIXEL_ID and num_void > len(neighbours) / 2:
-                pixel_grid[row][col] = pixel_maths.VOID_PIXEL_ID
-
-    # Return cleaned pixel grid
-    return pixel_grid
-
-def smoothen_edges(pixel_grid:list) -> list:
-    """
-    Smoothen the edges of grains by merging pixels
-    
-    Parameters:
-    * `pixel_grid`: The unsmoothed grid of pixels
-    
-    Returns the smoothed pixel grid
-    """
-
-    # Dimensions of the pixel grid
-    x_size = len(pixel_grid[0])
-    y_size = len(pixel_grid)
-    
-    # Iterate through each pixel
-    for row in range(y_size):
-        for col in range(x_size):
-        
-            # Ignore if it's added material
-            if pixel_grid[row][col] == pixel_maths.UNORIENTED_PIXEL_ID:
-                continue
-
-            # Evaluate neighbouring pixels
-            neighbours = pixel_maths.get_neighbours(col, row, x_size, y_size)
-            foreign_neighbours = [n for n in neighbours if pixel_grid[n[1]][n[0]] != pixel_grid[row][col]]
-
-            # If there are more than 2 foreign neighbours, get absorbed
-            if len(foreign_neighbours) > 2:
-                foreign = foreign_neighbours[randint(0, len(foreign_neighbours) - 1)]
-                if pixel_grid[foreign[1]][foreign[0]] == pixel_maths.UNORIENTED_PIXEL_ID:
-                    continue
-                pixel_grid[row][col] = pixel_grid[foreign[1]][foreign[0]]
-
-    # Return cleaned pixel grid
-    return pixel_grid
-
-def pad_edges(pixel_grid:list) -> list:
-    """
-    Pads the pixel grid by replicating unvoided pixels
-    
-    Parameters:
-    * `pixel_grid`: The unpadded grid of pixels
-    
-    Returns the padded pixel grid
-    """
-    
-    # Dimensions of the pixel grid
-    x_size = len(pixel_grid[0])
-    y_size = len(pixel_grid)
-    
-    # Replicate it
-    padded_pixel_grid = pixel_maths.get_void_pixel_grid(x_size, y_size)
-
-    # Iterate through each pixel
-    for row in range(y_size):
-        for col in range(x_size):
-
-            # If live, copy and skip
-            if pixel_grid[row][col] != pixel_maths.VOID_PIXEL_ID:
-                padded_pixel_grid[row][col] = pixel_grid[row][col]
-                continue
-
-            # Get live neighbouring pixels
-            neighbours = pixel_maths.get_neighbours(col, row, x_size, y_size)
-            live_neighbours = [n for n in neighbours if pixel_grid[n[1]][n[0]] != pixel_maths.VOID_PIXEL_ID]
-
-            # If there is a live neighbour, then fill this void pixel
-            if len(live_neighbours) > 0:
-                copy = live_neighbours[randint(0, len(live_neighbours) - 1)]
-                padded_pixel_grid[row][col] = pixel_grid[copy[1]][copy[0]]
-    
-    # Return padded pixel grid
-    return padded_pixel_grid
-
-def get_sorted_grain_id_list(pixel_grid:list) -> tuple:
-    """
-    Gets sorted list of grain ids without voids
-    
-    Parameters:
-    * `pixel_grid`: The unpadded grid of pixels
-    
-    Returns the sorted IDs and the flattened IDs
-    """
-    flattened = [pixel for pixel_list in pixel_grid for pixel in pixel_list]
-    id_list = list(set(flattened))
-    if pixel_maths.VOID_PIXEL_ID in id_list:
-        id_list.remove(pixel_maths.VOID_PIXEL_ID)
-    id_list.sort()
-    return id_list, flattened
-
-def remove_small_grains(pixel_grid:list, threshold:int) -> list:
-    """
-    Removes small grains
-    
-    Parameters:
-    * `pixel_grid`: The unremoved grid of pixels
-    * `threshold`:  The grain size threshold to start removing grains
-    
-    Returns the pixel grid without the small grains
-    """
-    
-    # Initialise
-    id_list, flattened = get_sorted_grain_id_list(pixel_grid)
-    x_size = len(pixel_grid[0])
-    y_size = len(pixel_grid)
-
-    # Remove grains under size threshold
-    for id in id_list:
-
-        # Only consider grains under threshold
-        if flattened.count(id) >= threshold:
-            continue
-
-        # Get the coordinates of all the pixels
-        x_list, y_list = [], []
-        for row in range(y_size):
-            for col in range(x_size):
-                if pixel_grid[row][col] != id:
-                    continue
-                x_list.append(col)
-                y_list.append(row)
-
-        # Find most neighbouring grain
-        neighbours = pixel_maths.get_all_neighbours(x_list, y_list, x_size, y_size)
-        neighbour_ids = [pixel_grid[neighbour[1]][neighbour[0]] for neighbour in neighbours]
-        most_neighbouring = max(set(neighbour_ids), key=neighbour_ids.count)
-
-        # Replace coordinates of small grain
-        for i in range(len(x_list)):
-            pixel_grid[y_list[i]][x_list[i]] = most_neighbouring
-    
-    # Return the new pixel grid
-    return pixel_grid
-
-def merge_grains(pixel_grid:list, grain_map:dict, threshold:int=10) -> list:
-    """
-    Merges commonly oriented grains
-    
-    Parameters:
-    * `pixel_grid`: The unmerged grid of pixels
-    * `grain_map`:  The mapping from grain IDs to their orientations
-    * `threshold`:  The grain size threshold to start removing grains
-    
-    Returns the pixel grid with the merged grains
-    """
-
-    # Intialise
-    id_list, _ = get_sorted_grain_id_list(pixel_grid)
-    new_pixel_grid = deepcopy(pixel_grid)
-    merge_map = {}
-    
-    # Identify grains to merge
-    for i in range(len(id_list)):
-        orientation_1 = grain_map[id_list[i]].get_orientation()
-        for j in range(i+1, len(id_list)):
-            orientation_2 = grain_map[id_list[j]].get_orientation()
-            error = sum([abs(orientation_1[k] - orientation_2[k]) for k in range(3)])
-            if error < threshold:
-                if id_list[i] in merge_map.keys():
-                    merge_map[id_list[i]] += [id_list[j]]
-                else:
-                    merge_map[id_list[i]] = [id_list[j]]
-
-    # Merge the grains in the pixel grid
-    for id in merge_map.keys():
-        for i in range(len(pixel_grid)):
-            for j in range(len(pixel_grid[0])):
-                if new_pixel_grid[i][j] in merge_map[id]:
-                    new_pixel_grid[i][j] = id
-    
-    # Print summary and return
-    new_id_list, _ = get_sorted_grain_id_list(new_pixel_grid)
-    print("=========================")
-    print(f"Merged from {len(id_list)} grains to {len(new_id_list)} grains")
-    print("=========================")
-    return new_pixel_grid
+"""
+ Title:         Improver
+ Description:   Improves the quality of the grid
+ Author:        Janzen Choi
+
+"""
+
+# Libraries
+import numpy as np
+import sm_cubit.maths.pixel_maths as pixel_maths
+
+# Numba kernels are optional; fall back to the NumPy / Python versions without them
+try:
+    import sm_cubit.visuals._improver_numba as _improver_numba
+except ImportError:
+    _improver_numba = None
+
+def clean_pixel_grid(pixel_grid:list, to_list:bool=True) -> list:
+    """
+    Cleans the pixel grid by replacing stray void / live pixels
+
+    Parameters:
+    * `pixel_grid`: The uncleaned grid of pixels
+    * `to_list`:    If true, returns the grid as a list of lists
+
+    Returns the cleaned pixel grid
+    """
+
+    # Dimensions of the pixel grid
+    grid = np.asarray(pixel_grid, dtype=np.int32)
+    x_size = grid.shape[1]
+    y_size = grid.shape[0]
+
+    # Run the compiled kernel if available
+    if _improver_numba is not None:
+        cleaned = _improver_numba._clean(grid, pixel_maths.VOID_PIXEL_ID, pixel_maths.UNORIENTED_PIXEL_ID)
+        return cleaned.tolist() if to_list else cleaned
+
+    # Count the void neighbours of each pixel by summing the shifted void mask
+    void_mask = grid == pixel_maths.VOID_PIXEL_ID
+    live_mask = grid != pixel_maths.UNORIENTED_PIXEL_ID
+    bordered = np.pad(void_mask, 1).astype(np.uint8)
+    num_void = bordered[1:-1,:-2] + bordered[1:-1,2:] + bordered[:-2,1:-1] + bordered[2:,1:-1]
+
+    # Count the total neighbours of each pixel (fewer on the borders)
+    num_neighbours = np.full(grid.shape, 4, dtype=np.uint8)
+    num_neighbours[0,:]  -= 1
+    num_neighbours[-1,:] -= 1
+    num_neighbours[:,0]  -= 1
+    num_neighbours[:,-1] -= 1
+
+    # If more than half of the neighbours are void, then remove a live pixel
+    grid[live_mask & ~void_mask & (2 * num_void > num_neighbours)] = pixel_maths.VOID_PIXEL_ID
+
+    # If half (or less) of the neighbours are void, then fill a void pixel
+    fill_pixels = np.argwhere(void_mask & (2 * num_void <= num_neighbours))
+    uniform = np.random.default_rng().random(len(fill_pixels))
+    for i, (row, col) in enumerate(fill_pixels):
+        neighbours = [
+            (col+dx, row+dy) for dx, dy in pixel_maths.NEIGHBOUR_OFFSETS
+            if col+dx >= 0 and col+dx < x_size
+            and row+dy >= 0 and row+dy < y_size
+        ]
+        copy = neighbours[int(uniform[i] * len(neighbours))]
+        if grid[copy[1]][copy[0]] == pixel_maths.UNORIENTED_PIXEL_ID:
+            continue
+        grid[row][col] = grid[copy[1]][copy[0]]
+
+    # Return cleaned pixel grid
+    return grid.tolist() if to_list else grid
+
+def smoothen_edges(pixel_grid:list, to_list:bool=True) -> list:
+    """
+    Smoothen the edges of grains by merging pixels
+    
+    Parameters:
+    * `pixel_grid`: The unsmoothed grid of pixels
+    * `to_list`:    If true, returns the grid as a list of lists
+    
+    Returns the smoothed pixel grid
+    """
+
+    # Dimensions of the pixel grid
+    x_size = len(pixel_grid[0])
+    y_size = len(pixel_grid)
+
+    # Run the compiled kernel if available
+    if _improver_numba is not None:
+        grid = np.asarray(pixel_grid, dtype=np.int32)
+        smoothed = _improver_numba._smoothen(grid, pixel_maths.UNORIENTED_PIXEL_ID)
+        return smoothed.tolist() if to_list else smoothed
+
+    # Draw the random numbers for the reservoir samples in one batch
+    uniform = np.random.default_rng().random((y_size, x_size, 4))
+
+    # Iterate through each pixel
+    for row in range(y_size):
+        for col in range(x_size):
+
+            # Ignore if it's added material
+            pixel = pixel_grid[row][col]
+            if pixel == pixel_maths.UNORIENTED_PIXEL_ID:
+                continue
+
+            # Count the foreign neighbours and reservoir-sample one of them
+            num_foreign = 0
+            pick_row, pick_col = -1, -1
+            for dx, dy in pixel_maths.NEIGHBOUR_OFFSETS:
+                n_row, n_col = row+dy, col+dx
+                if n_row < 0 or n_row >= y_size or n_col < 0 or n_col >= x_size:
+                    continue
+                if pixel_grid[n_row][n_col] != pixel:
+                    num_foreign += 1
+                    if uniform[row, col, num_foreign-1] * num_foreign < 1:
+                        pick_row, pick_col = n_row, n_col
+
+            # If there are more than 2 foreign neighbours, get absorbed
+            if num_foreign > 2:
+                foreign = pixel_grid[pick_row][pick_col]
+                if foreign == pixel_maths.UNORIENTED_PIXEL_ID:
+                    continue
+                pixel_grid[row][col] = foreign
+
+    # Return smoothed pixel grid
+    if to_list:
+        return pixel_grid.tolist() if isinstance(pixel_grid, np.ndarray) else pixel_grid
+    return np.asarray(pixel_grid, dtype=np.int32)
+
+def pad_edges(pixel_grid:list, to_list:bool=True) -> list:
+    """
+    Pads the pixel grid by replicating unvoided pixels
+    
+    Parameters:
+    * `pixel_grid`: The unpadded grid of pixels
+    * `to_list`:    If true, returns the grid as a list of lists
+    
+    Returns the padded pixel grid
+    """
+    
+    # Dimensions of the pixel grid
+    grid = np.asarray(pixel_grid, dtype=np.int32)
+
+    # Run the compiled kernel if available
+    if _improver_numba is not None:
+        padded = _improver_numba._pad(grid, pixel_maths.VOID_PIXEL_ID)
+        return padded.tolist() if to_list else padded
+
+    # Stack the grid shifted towards each of the 4 neighbours
+    bordered = np.pad(grid, 1, mode="constant", constant_values=pixel_maths.VOID_PIXEL_ID)
+    stack = np.stack([
+        bordered[1:-1, :-2], # left
+        bordered[1:-1, 2:],  # right
+        bordered[:-2, 1:-1], # up
+        bordered[2:, 1:-1],  # down
+    ])
+
+    # Pick a random live neighbour for each pixel
+    live = stack != pixel_maths.VOID_PIXEL_ID
+    picks = (np.random.default_rng().random(stack.shape) * live).argmax(axis=0)
+    filled = np.take_along_axis(stack, picks[None], axis=0)[0]
+
+    # Fill the void pixels that have a live neighbour
+    padded = grid.copy()
+    fill_mask = (grid == pixel_maths.VOID_PIXEL_ID) & live.any(axis=0)
+    padded[fill_mask] = filled[fill_mask]
+
+    # Return padded pixel grid
+    return padded.tolist() if to_list else padded
+
+def improve_grid(pixel_grid:list, do_clean:bool=True, do_smooth:bool=True, do_pad:bool=True, to_list:bool=True) -> list:
+    """
+    Cleans, smoothens, and pads the pixel grid in a single fused pass
+
+    Parameters:
+    * `pixel_grid`: The grid of pixels
+    * `do_clean`:   Whether to clean the pixel grid
+    * `do_smooth`:  Whether to smoothen the grain edges
+    * `do_pad`:     Whether to pad the grain edges
+    * `to_list`:    If true, returns the grid as a list of lists
+
+    Returns the improved pixel grid
+    """
+
+    # Run the compiled kernels back to back on the same array
+    if _improver_numba is not None:
+        grid = np.asarray(pixel_grid, dtype=np.int32)
+        if do_clean:
+            grid = _improver_numba._clean(grid, pixel_maths.VOID_PIXEL_ID, pixel_maths.UNORIENTED_PIXEL_ID)
+        if do_smooth:
+            grid = _improver_numba._smoothen(grid, pixel_maths.UNORIENTED_PIXEL_ID)
+        if do_pad:
+            grid = _improver_numba._pad(grid, pixel_maths.VOID_PIXEL_ID)
+        return grid.tolist() if to_list else grid
+
+    # Otherwise chain the fallback implementations on the array
+    grid = np.asarray(pixel_grid, dtype=np.int32)
+    if do_clean:
+        grid = clean_pixel_grid(grid, to_list=False)
+    if do_smooth:
+        grid = smoothen_edges(grid, to_list=False)
+    if do_pad:
+        grid = pad_edges(grid, to_list=False)
+    return grid.tolist() if to_list else grid
+
+def get_sorted_grain_id_list(pixel_grid:list) -> tuple:
+    """
+    Gets sorted list of grain ids without voids
+    
+    Parameters:
+    * `pixel_grid`: The unpadded grid of pixels
+    
+    Returns the sorted IDs and the flattened IDs
+    """
+    flattened = np.asarray(pixel_grid, dtype=np.int32).ravel()
+    id_list = np.unique(flattened)
+    id_list = id_list[id_list != pixel_maths.VOID_PIXEL_ID]
+    return id_list.tolist(), flattened
+
+def remove_small_grains(pixel_grid:list, threshold:int, to_list:bool=True) -> list:
+    """
+    Removes small grains
+    
+    Parameters:
+    * `pixel_grid`: The unremoved grid of pixels
+    * `threshold`:  The grain size threshold to start removing grains
+    * `to_list`:    If true, returns the grid as a list of lists
+    
+    Returns the pixel grid without the small grains
+    """
+    
+    # Initialise
+    id_list, flattened = get_sorted_grain_id_list(pixel_grid)
+    grid = np.asarray(pixel_grid, dtype=np.int32)
+    x_size = grid.shape[1]
+    y_size = grid.shape[0]
+
+    # Bucket the pixel indexes of every grain with a single sort
+    order = np.argsort(flattened, kind="stable")
+    sorted_ids = flattened[order]
+    starts = np.searchsorted(sorted_ids, id_list)
+    ends = np.searchsorted(sorted_ids, id_list, side="right")
+    index_map = dict(zip(id_list, [order[starts[i]:ends[i]] for i in range(len(id_list))]))
+    size_map = dict(zip(id_list, (ends - starts).tolist()))
+
+    # Remove grains under size threshold
+    for id in id_list:
+
+        # Only consider grains under threshold
+        if size_map[id] >= threshold:
+            continue
+        indexes = index_map[id]
+
+        # Get the coordinates of all the pixels
+        y_array, x_array = np.divmod(indexes, x_size)
+        x_list, y_list = x_array.tolist(), y_array.tolist()
+
+        # Find most neighbouring grain
+        neighbours = pixel_maths.get_all_neighbours(x_list, y_list, x_size, y_size)
+        neighbour_ids = grid[[n[1] for n in neighbours], [n[0] for n in neighbours]]
+        values, counts = np.unique(neighbour_ids, return_counts=True)
+        most_neighbouring = int(values[counts.argmax()])
+
+        # Replace coordinates of small grain and pass its pixels on
+        grid[y_array, x_array] = most_neighbouring
+        if most_neighbouring in index_map:
+            index_map[most_neighbouring] = np.concatenate((index_map[most_neighbouring], indexes))
+
+    # Return the new pixel grid
+    return grid.tolist() if to_list else grid
+
+def get_orientation_array(grain_map:dict, id_list:list) -> np.ndarray:
+    """
+    Stacks the orientations of the listed grains into an array
+
+    Parameters:
+    * `grain_map`: The mapping from grain IDs to their orientations
+    * `id_list`:   The list of grain IDs
+
+    Returns an array of orientations with one row per grain
+    """
+    orientations = np.empty((len(id_list), 3), dtype=np.float64)
+    for i, id in enumerate(id_list):
+        orientations[i] = grain_map[id].get_orientation()
+    return orientations
+
+def merge_grains(pixel_grid:list, grain_map:dict, threshold:int=10, to_list:bool=True) -> list:
+    """
+    Merges commonly oriented grains
+    
+    Parameters:
+    * `pixel_grid`: The unmerged grid of pixels
+    * `grain_map`:  The mapping from grain IDs to their orientations
+    * `threshold`:  The grain size threshold to start removing grains
+    * `to_list`:    If true, returns the grid as a list of lists
+    
+    Returns the pixel grid with the merged grains
+    """
+
+    # Intialise
+    id_list, _ = get_sorted_grain_id_list(pixel_grid)
+    grid = np.asarray(pixel_grid, dtype=np.int32)
+    merge_map = {}
+    
+    # Compute the pairwise orientation errors in one broadcast
+    orientations = get_orientation_array(grain_map, id_list)
+    errors = np.abs(orientations[:,None,:] - orientations[None,:,:]).sum(axis=-1)
+    errors[np.tril_indices_from(errors)] = np.inf
+
+    # Identify grains to merge
+    for i, j in np.argwhere(errors < threshold):
+        if id_list[i] in merge_map.keys():
+            merge_map[id_list[i]] += [id_list[j]]
+        else:
+            merge_map[id_list[i]] = [id_list[j]]
+
+    # Merge the grains in the pixel grid with a lookup table;
+    # filled in reverse so that the smallest merging ID takes precedence
+    relabel = np.arange(int(grid.max()) + 1, dtype=np.int32)
+    for id in reversed(merge_map.keys()):
+        relabel[merge_map[id]] = id
+    new_grid = relabel[grid]
+    
+    # Print summary and return
+    new_id_list, _ = get_sorted_grain_id_list(new_grid)
+    print("=========================")
+    print(f"Merged from {len(id_list)} grains to {len(new_id_list)} grains")
+    print("=========================")
+    return new_grid.tolist() if to_list else new_grid